@@ -5,48 +5,108 @@ Search your documents by meaning, not keywords
 
 from __future__ import annotations
 
+import os
 from datetime import datetime
+from itertools import chain
 from typing import Iterable
 
 import gradio as gr
 
 from src.storage import (
+    FAISS_INDEX_PATH,
+    METADATA_PATH,
     ensure_dirs,
     list_uploaded_pdfs,
+    scan_uploaded_pdfs,
     save_uploaded_path,
     delete_uploaded_file,
     clear_index,
     index_exists,
     get_index_stats,
 )
-from src.pdf_ingest import extract_from_multiple
-from src.chunking import process_all_documents
+from src.chunking import prune_chunk_cache
+from src.embedder import get_tokenizer
+from src.pipeline import stream_chunks
 from src.vector_index import build_index, save_index_and_metadata
-from src.search import search as semantic_search, format_citation, highlight_keywords
+from src.search import (
+    DEFAULT_EF_SEARCH,
+    DEFAULT_NPROBE,
+    search_one as semantic_search,
+    format_citation,
+    highlight_keywords,
+)
 
 ensure_dirs()
 
 
+# formatted index stats, keyed on the mtimes of the files they came from
+# so UI callbacks don't reload the index every time
+_format_cache: dict[str, tuple] = {}
+
+
+def _mtime_ns(path) -> int | None:
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
 def _format_docs_list() -> str:
-    pdfs = list_uploaded_pdfs()
+    # the listing is cached in storage (and so are the entries' stat() results),
+    # so this is cheap on every callback and still sees overwritten files
+    pdfs = scan_uploaded_pdfs()
     if not pdfs:
         return "No documents uploaded yet."
-    lines = [f"- {p.name} ({p.stat().st_size / 1024:.1f} KB)" for p in pdfs]
-    return "\n".join(lines)
+    return "\n".join(f"- {e.name} ({e.stat().st_size / 1024:.1f} KB)" for e in pdfs)
 
 
 def _format_index_stats() -> str:
+    # saves swap in new index files (os.replace), which gives them a new mtime
+    key = (_mtime_ns(FAISS_INDEX_PATH), _mtime_ns(METADATA_PATH))
+    cached = _format_cache.get("stats")
+    if cached and cached[0] == key:
+        return cached[1]
+
     if not index_exists():
-        return "No index built yet."
-    stats = get_index_stats()
-    if not stats:
-        return "Index exists but stats are unavailable."
-    return (
-        f"Documents: {stats['total_docs']}\n"
-        f"Chunks: {stats['total_chunks']}\n"
-        f"Embedding Dim: {stats['embedding_dim']}\n"
-        f"Index Size: {stats['index_size']}"
-    )
+        text = "No index built yet."
+    elif not (stats := get_index_stats()):
+        text = "Index exists but stats are unavailable."
+    else:
+        text = (
+            f"Documents: {stats['total_docs']}\n"
+            f"Chunks: {stats['total_chunks']}\n"
+            f"Embedding Dim: {stats['embedding_dim']}\n"
+            f"Index Size: {stats['index_size']}"
+        )
+    _format_cache["stats"] = (key, text)
+    return text
+
+
+def _index_pdfs(pdfs, progress) -> bool:
+    """
+    extract, chunk, embed and save the index for these PDFs
+    the stages overlap and the chunk count isn't known up front,
+    so progress just reports how many chunks have been embedded
+    returns False if there was nothing to index
+    """
+    progress(0.1, desc="Extracting Text")
+    chunks = stream_chunks(pdfs)
+    first = next(chunks, None)
+    if first is None:
+        return False
+
+    def update_progress(current, total):
+        # no total for a stream, so show a busy (indeterminate) bar with the count
+        progress(None, desc=f"Embedding And Building Index ({current} chunks)")
+
+    index, metadata = build_index(chain([first], chunks), progress_callback=update_progress)
+
+    progress(0.95, desc="Saving")
+    save_index_and_metadata(index, metadata)
+    # these are all the uploads, so cached chunks for anything else are stale
+    prune_chunk_cache(pdfs, get_tokenizer())
+    progress(1.0, desc="Done")
+    return True
 
 
 def upload_and_index(files: list[str] | None, progress=gr.Progress()):
@@ -58,29 +118,9 @@ def upload_and_index(files: list[str] | None, progress=gr.Progress()):
         save_uploaded_path(file_path)
         saved += 1
 
-    progress(0.1, desc="Extracting Text")
-    pdfs = list_uploaded_pdfs()
-    docs = extract_from_multiple(pdfs)
-    if not docs:
+    if not _index_pdfs(list_uploaded_pdfs(), progress):
         return "No text could be extracted. The PDFs might be scanned images.", _format_docs_list(), _format_index_stats()
 
-    progress(0.3, desc="Chunking")
-    chunks = process_all_documents(docs)
-    if not chunks:
-        return "No chunks created. The documents might be empty.", _format_docs_list(), _format_index_stats()
-
-    progress(0.5, desc="Embedding And Building Index")
-
-    def update_progress(current, total):
-        if total:
-            progress(0.5 + (current / total) * 0.4, desc=f"Embedding {current}/{total}")
-
-    index, metadata = build_index(chunks, progress_callback=update_progress)
-
-    progress(0.95, desc="Saving")
-    save_index_and_metadata(index, metadata)
-    progress(1.0, desc="Done")
-
     msg = f"Index built successfully at {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
     return msg, _format_docs_list(), _format_index_stats()
 
@@ -90,26 +130,9 @@ def rebuild_index(progress=gr.Progress()):
     if not pdfs:
         return "No PDFs to index.", _format_docs_list(), _format_index_stats()
 
-    progress(0.1, desc="Extracting Text")
-    docs = extract_from_multiple(pdfs)
-    if not docs:
+    if not _index_pdfs(pdfs, progress):
         return "No text extracted from PDFs.", _format_docs_list(), _format_index_stats()
 
-    progress(0.3, desc="Chunking")
-    chunks = process_all_documents(docs)
-
-    progress(0.5, desc="Embedding And Building Index")
-
-    def update_progress(current, total):
-        if total:
-            progress(0.5 + (current / total) * 0.4, desc=f"Embedding {current}/{total}")
-
-    index, metadata = build_index(chunks, progress_callback=update_progress)
-
-    progress(0.95, desc="Saving")
-    save_index_and_metadata(index, metadata)
-    progress(1.0, desc="Done")
-
     return "Index rebuilt successfully.", _format_docs_list(), _format_index_stats()
 
 
@@ -127,16 +150,17 @@ def delete_selected_uploads(selected: list[str] | None):
 
 
 def list_upload_names() -> list[str]:
-    return [p.name for p in list_uploaded_pdfs()]
+    return [e.name for e in scan_uploaded_pdfs()]
 
 
-def run_search(query: str, top_k: int, citations: bool, highlight: bool):
+def run_search(query: str, top_k: int, citations: bool, highlight: bool,
+               nprobe: int = DEFAULT_NPROBE, ef_search: int = DEFAULT_EF_SEARCH):
     if not index_exists():
         return "No index found. Upload PDFs and build the index first."
     if not query.strip():
         return "Please enter a search query."
 
-    results = semantic_search(query.strip(), k=top_k)
+    results = semantic_search(query.strip(), k=top_k, nprobe=nprobe, ef_search=ef_search)
     if not results:
         return "No matching results found. Try rephrasing your query."
 
@@ -3,8 +3,21 @@ Chunking logic - splits documents into searchable pieces
 overlapping them so we don't lose context at the edges
 """
 
+import os
+import re
+import pickle
+import tempfile
 import hashlib
-from typing import Generator
+from concurrent.futures import Future, ProcessPoolExecutor
+from functools import lru_cache
+from itertools import chain
+from pathlib import Path
+from typing import Generator, Optional
+
+import numpy as np
+
+from .pdf_ingest import MP_CONTEXT
+from .storage import UPLOADS_DIR, CHUNK_CACHE_DIR, ensure_dirs
 
 
 # Config - about 300 words per chunk with 50 word overlap
@@ -12,10 +25,95 @@ from typing import Generator
 CHUNK_SIZE_WORDS = 300
 CHUNK_OVERLAP_WORDS = 50
 
+# a "word" is any run of non-whitespace - compiled once, shared by everything below
+_WS = re.compile(r"\S+")
+
 
 def generate_doc_id(filename: str) -> str:
     """generate a stable ID from the filename"""
-    return hashlib.md5(filename.encode()).hexdigest()[:12]
+    return hashlib.blake2b(filename.encode(), digest_size=6).hexdigest()
+
+
+def _file_sha256(path: Path) -> str:
+    """hash the file contents, so an edited upload with the same name misses the cache"""
+    stat = path.stat()
+    return _sha256_of(str(path), stat.st_mtime_ns, stat.st_size)
+
+
+@lru_cache(maxsize=1024)
+def _sha256_of(path: str, mtime_ns: int, size: int) -> str:
+    """hash a file once per version of it (mtime + size are just the cache key)"""
+    return hashlib.sha256(Path(path).read_bytes()).hexdigest()
+
+
+def _chunk_cache_path(filename: str, sha: str, tokenizer=None) -> Path:
+    """
+    where the cached chunks for this file live
+    keyed on content + chunk settings (and the name, since chunks carry it),
+    plus the tokenizer if the chunks were pre-tokenized with one
+    """
+    tokens_tag = "text"
+    if tokenizer is not None:
+        tokens_tag = hashlib.blake2b(tokenizer.name_or_path.encode(), digest_size=4).hexdigest()
+    return CHUNK_CACHE_DIR / (
+        f"{sha}_{generate_doc_id(filename)}_{CHUNK_SIZE_WORDS}_{CHUNK_OVERLAP_WORDS}_{tokens_tag}.pkl"
+    )
+
+
+def load_cached_chunks(pdf_paths: list[Path], tokenizer=None) -> tuple[list[dict], list[Path]]:
+    """
+    grab chunks we already computed for these PDFs on a previous run
+    pass the same tokenizer given to process_all_documents to get pre-tokenized chunks
+    
+    Returns:
+        (cached chunks, PDFs that still need extracting + chunking)
+    """
+    cached = []
+    pending = []
+    
+    for path in pdf_paths:
+        cache_path = _chunk_cache_path(path.name, _file_sha256(path), tokenizer)
+        try:
+            with open(cache_path, "rb") as f:
+                cached.extend(pickle.load(f))
+        except FileNotFoundError:
+            pending.append(path)
+        except Exception as e:
+            # half-written or otherwise broken - just redo this file
+            print(f"ignoring broken chunk cache for {path.name}: {e}")
+            cache_path.unlink(missing_ok=True)
+            pending.append(path)
+    
+    return cached, pending
+
+
+def prune_chunk_cache(pdf_paths: list[Path], tokenizer=None) -> int:
+    """
+    delete cached chunks that don't belong to these PDFs (as they are now,
+    with this tokenizer) - edited, renamed and deleted uploads would otherwise
+    leave their old chunks behind forever. call it with every upload after a
+    full index build. returns how many cache files were removed
+    """
+    if not CHUNK_CACHE_DIR.exists():
+        return 0
+    
+    keep = {_chunk_cache_path(path.name, _file_sha256(path), tokenizer).name
+            for path in pdf_paths if path.exists()}
+    removed = 0
+    for cache_path in CHUNK_CACHE_DIR.glob("*.pkl"):
+        if cache_path.name not in keep:
+            cache_path.unlink(missing_ok=True)
+            removed += 1
+    return removed
+
+
+def _word_spans(text: str) -> tuple[np.ndarray, np.ndarray]:
+    """
+    one pass over the text to find where every word starts and ends
+    returns (char_starts, char_ends) so chunks can be sliced straight out of the text
+    """
+    flat = np.fromiter(chain.from_iterable(m.span() for m in _WS.finditer(text)), dtype=np.int64)
+    return flat[0::2], flat[1::2]
 
 
 def chunk_text(text: str, chunk_size: int = CHUNK_SIZE_WORDS, 
@@ -24,102 +122,197 @@ def chunk_text(text: str, chunk_size: int = CHUNK_SIZE_WORDS,
     split text into overlapping chunks based on word count
     yields chunk strings
     """
-    words = text.split()
+    char_starts, char_ends = _word_spans(text)
+    num_words = len(char_starts)
     
-    if len(words) <= chunk_size:
+    if num_words <= chunk_size:
         # text is short enough, just one chunk
         yield text
         return
     
-    start = 0
-    while start < len(words):
-        end = start + chunk_size
-        chunk_words = words[start:end]
-        yield " ".join(chunk_words)
-        
-        # move forward by (chunk_size - overlap)
-        start += chunk_size - overlap
-        
-        # if what's left is smaller than overlap, stop
-        if start >= len(words):
-            break
+    # move forward by (chunk_size - overlap) each time
+    for start in range(0, num_words, chunk_size - overlap):
+        end = min(start + chunk_size, num_words)
+        yield text[char_starts[start]:char_ends[end - 1]]
 
 
-def create_chunks_with_metadata(doc_pages: list[dict], filename: str) -> list[dict]:
+def create_chunks_with_metadata(doc_pages: list[dict], 
+                                filename: str) -> Generator[dict, None, None]:
     """
     create chunks from document pages, keeping page number info
+    chunk text is only sliced out as each chunk is yielded
     
     Args:
         doc_pages: List of {"page_num": int, "text": str}
         filename: Original filename
     
-    Returns:
-        List of chunk metadata dicts ready for indexing
+    Yields:
+        Chunk metadata dicts ready for indexing
     """
     doc_id = generate_doc_id(filename)
-    chunks = []
     chunk_counter = 0
     
-    # combine all text with page markers
-    # so we can chunk across page boundaries smoothly
-    combined_parts = []
-    for page in doc_pages:
-        words = page["text"].split()
-        for word in words:
-            combined_parts.append({
-                "word": word,
-                "page": page["page_num"]
-            })
+    # combine all pages into one string so we can chunk across page
+    # boundaries smoothly, remembering where each page starts
+    full_text = "\n".join(page["text"] for page in doc_pages)
+    page_lengths = np.fromiter((len(page["text"]) + 1 for page in doc_pages), dtype=np.int64)
+    page_offsets = np.cumsum(page_lengths) - page_lengths
+    page_nums = np.fromiter((page["page_num"] for page in doc_pages), dtype=np.int32)
     
-    if not combined_parts:
-        return []
+    char_starts, char_ends = _word_spans(full_text)
+    num_words = len(char_starts)
     
-    # now chunk through the combined text
-    start_idx = 0
+    if not num_words:
+        return
+    
+    if num_words <= CHUNK_SIZE_WORDS:
+        # short doc, just one chunk - no need for per-word page lookups
+        yield {
+            "doc_id": doc_id,
+            "file_name": filename,
+            "chunk_id": f"{doc_id}_0",
+            "page_start": int(page_nums.min()),
+            "page_end": int(page_nums.max()),
+            "text": full_text[char_starts[0]:char_ends[-1]]
+        }
+        return
+    
+    # page number of every word, from which page its first character falls in
+    pages_arr = page_nums[np.searchsorted(page_offsets, char_starts, side="right") - 1]
     
-    while start_idx < len(combined_parts):
-        end_idx = min(start_idx + CHUNK_SIZE_WORDS, len(combined_parts))
+    # now chunk through the combined text
+    for start_idx in range(0, num_words, CHUNK_SIZE_WORDS - CHUNK_OVERLAP_WORDS):
+        end_idx = min(start_idx + CHUNK_SIZE_WORDS, num_words)
         
-        chunk_parts = combined_parts[start_idx:end_idx]
-        chunk_text = " ".join(p["word"] for p in chunk_parts)
+        chunk_text = full_text[char_starts[start_idx]:char_ends[end_idx - 1]]
         
         # figure out which pages this chunk spans
-        pages_in_chunk = sorted(set(p["page"] for p in chunk_parts))
-        page_start = pages_in_chunk[0]
-        page_end = pages_in_chunk[-1]
+        chunk_pages = pages_arr[start_idx:end_idx]
+        page_start = int(chunk_pages.min())
+        page_end = int(chunk_pages.max())
         
-        chunks.append({
+        yield {
             "doc_id": doc_id,
             "file_name": filename,
             "chunk_id": f"{doc_id}_{chunk_counter}",
             "page_start": page_start,
             "page_end": page_end,
             "text": chunk_text
-        })
+        }
         
         chunk_counter += 1
-        start_idx += CHUNK_SIZE_WORDS - CHUNK_OVERLAP_WORDS
-        
-        if start_idx >= len(combined_parts):
-            break
+
+
+def tokenize(chunks: list[dict], tokenizer) -> list[dict]:
+    """
+    pre-tokenize chunk texts in one batched call (HF fast tokenizers run in Rust)
+    
+    stores chunk["input_ids"] as an int32 array so the embedder can skip
+    its own tokenizer. ids aren't truncated here - the embedder cuts them
+    down to whatever the model's max sequence length is
+    """
+    if not chunks:
+        return chunks
+    
+    encoded = tokenizer([c["text"] for c in chunks], truncation=False, verbose=False)["input_ids"]
+    for chunk, ids in zip(chunks, encoded):
+        chunk["input_ids"] = np.asarray(ids, dtype=np.int32)
     
     return chunks
 
 
-def process_all_documents(docs_by_file: dict[str, list[dict]]) -> list[dict]:
+def _upload_sha256(filename: str) -> Optional[str]:
+    """content hash of an uploaded PDF, None if it's not in the uploads folder"""
+    pdf_path = UPLOADS_DIR / filename
+    return _file_sha256(pdf_path) if pdf_path.exists() else None
+
+
+def _chunk_one(item: tuple[str, list[dict], Optional[str]], tokenizer=None) -> list[dict]:
+    """
+    chunk (and cache) a single document - runs inside a worker process
+    item is (filename, pages, sha256 of the upload or None) - the hash comes
+    from the parent, which already read the file, so workers don't read it again
+    """
+    filename, pages, sha = item
+    chunks = list(create_chunks_with_metadata(pages, filename))
+    
+    if tokenizer is not None:
+        tokenize(chunks, tokenizer)
+    
+    # remember the result so the next rebuild can skip this file
+    if sha is not None:
+        _write_cache(_chunk_cache_path(filename, sha, tokenizer), chunks)
+    
+    return chunks
+
+
+def _write_cache(cache_path: Path, chunks: list[dict]):
+    """
+    same swap trick as save_metadata - readers never see a half-written file.
+    the temp name is unique, since two indexing runs may cache the same file at once
+    """
+    with tempfile.NamedTemporaryFile("wb", dir=cache_path.parent, suffix=".tmp", delete=False) as f:
+        pickle.dump(chunks, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(f.name, cache_path)
+
+
+# each worker process gets the tokenizer once, when it starts - handing it
+# over with every task would re-pickle the whole vocab each time
+_worker_tokenizer = None
+
+
+def _init_worker(tokenizer):
+    global _worker_tokenizer
+    _worker_tokenizer = tokenizer
+
+
+def _chunk_one_in_worker(item: tuple[str, list[dict], Optional[str]]) -> list[dict]:
+    return _chunk_one(item, _worker_tokenizer)
+
+
+def chunking_pool(tokenizer=None, max_workers: int | None = None) -> ProcessPoolExecutor:
+    """
+    worker processes for chunking documents, see submit_document()
+    keep one around for a whole indexing run - starting workers isn't free
+    """
+    # (MP_CONTEXT - workers must not be forked from our multithreaded process)
+    return ProcessPoolExecutor(max_workers=max_workers or os.cpu_count() or 1,
+                               mp_context=MP_CONTEXT,
+                               initializer=_init_worker, initargs=(tokenizer,))
+
+
+def submit_document(pool: ProcessPoolExecutor, filename: str, pages: list[dict]) -> Future:
+    """chunk (and cache) one document on a chunking_pool() worker, the future gives its chunk list"""
+    return pool.submit(_chunk_one_in_worker, (filename, pages, _upload_sha256(filename)))
+
+
+def process_all_documents(docs_by_file: dict[str, list[dict]], 
+                          tokenizer=None) -> Generator[dict, None, None]:
     """
     process multiple documents into chunks
+    documents are independent, so they get chunked in parallel across cores
     
     Args:
         docs_by_file: Dict mapping filename -> list of page dicts
+        tokenizer: Optional HF tokenizer to pre-tokenize chunks with (see tokenize())
     
-    Returns:
-        Flat list of all chunk metadata
+    Yields:
+        Chunk metadata for every document, one document after another -
+        feed it straight into build_index without holding a full list
+    
+    Chunks for files in the uploads folder get cached on disk,
+    see load_cached_chunks()
     """
-    all_chunks = []
+    ensure_dirs()
+    items = [(filename, pages, _upload_sha256(filename)) for filename, pages in docs_by_file.items()]
     
-    for filename, pages in docs_by_file.items():
-        chunks = create_chunks_with_metadata(pages, filename)
-        all_chunks.extend(chunks)
+    if len(items) <= 1:
+        # not worth spinning up worker processes for one file
+        for item in items:
+            yield from _chunk_one(item, tokenizer)
+        return
     
-    return all_chunks
+    workers = min(len(items), os.cpu_count() or 1)
+    with chunking_pool(tokenizer, workers) as executor:
+        for chunks in executor.map(_chunk_one_in_worker, items, chunksize=4):
+            yield from chunks
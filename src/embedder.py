@@ -3,14 +3,76 @@ Embedding module - converts text to meaning vectors
 all local, no APIs, totally offline
 """
 
+import os
+import platform
+import threading
 import numpy as np
+import torch
+from collections import OrderedDict
 from functools import lru_cache
+from typing import Optional
 from sentence_transformers import SentenceTransformer
 
 # small but mighty model that actually works great
 MODEL_NAME = "all-MiniLM-L6-v2"
 
 
+def thread_count_from_env(*names: str) -> int:
+    """
+    thread count from the first of these env vars that's set, else every core
+    OpenMP allows lists like "4,2" (one per nesting level) - the first one is ours.
+    values we can't make sense of are ignored rather than crashing at import
+    """
+    for name in names:
+        value = os.environ.get(name, "").split(",")[0].strip()
+        if value.isdigit() and int(value) > 0:
+            return int(value)
+    return os.cpu_count() or 1
+
+
+# model threads - every core by default, OMP_NUM_THREADS to override.
+# applies to PyTorch and to onnxruntime (the default CPU backend, see get_model).
+# one inter-op thread each, since a single encode() is one op graph at a time
+EMBED_NUM_THREADS = thread_count_from_env("OMP_NUM_THREADS")
+torch.set_num_threads(EMBED_NUM_THREADS)
+try:
+    torch.set_num_interop_threads(1)
+except RuntimeError:
+    # can only be set once, before torch runs anything in parallel
+    pass
+
+
+def _onnx_int8_file() -> str:
+    """
+    pick the int8 dynamically-quantized ONNX export (they ship with the model
+    on the hub) that's built for this CPU - onnxruntime runs these 2-4x faster
+    than PyTorch, for a tiny quality hit. VNNI has dedicated int8 dot-product
+    instructions, so that build is the fastest when the CPU supports it
+    """
+    if platform.machine().lower() in ("arm64", "aarch64"):
+        return "onnx/model_qint8_arm64.onnx"
+    
+    try:
+        with open("/proc/cpuinfo") as f:
+            cpu_flags = set(f.read().split())
+    except OSError:
+        cpu_flags = set()  # not Linux - AVX2 is the safe bet on any recent x86
+    
+    if "avx512_vnni" in cpu_flags:
+        return "onnx/model_qint8_avx512_vnni.onnx"
+    if "avx512bw" in cpu_flags:
+        return "onnx/model_qint8_avx512.onnx"
+    return "onnx/model_quint8_avx2.onnx"
+
+
+ONNX_INT8_FILE = _onnx_int8_file()
+
+# recent query vectors - repeat/popular queries skip the model entirely
+QUERY_CACHE_SIZE = 4096
+_query_cache: OrderedDict[str, np.ndarray] = OrderedDict()
+_query_cache_lock = threading.Lock()
+
+
 @lru_cache(maxsize=1)
 def get_model() -> SentenceTransformer:
     """
@@ -18,19 +80,47 @@ def get_model() -> SentenceTransformer:
     first load takes a few seconds, then it's instant
     """
     print(f"Loading embedding model: {MODEL_NAME}")
-    model = SentenceTransformer(MODEL_NAME)
-    print("Model loaded!")
+    if torch.cuda.is_available():
+        # on a GPU, half precision roughly doubles throughput and halves
+        # activation memory - cosine similarities barely move
+        model = SentenceTransformer(MODEL_NAME, device="cuda")
+        model.half()
+    else:
+        try:
+            import onnxruntime
+            
+            # onnxruntime has its own thread pools, torch's settings don't reach them
+            session_options = onnxruntime.SessionOptions()
+            session_options.intra_op_num_threads = EMBED_NUM_THREADS
+            session_options.inter_op_num_threads = 1
+            model = SentenceTransformer(
+                MODEL_NAME,
+                backend="onnx",
+                model_kwargs={"file_name": ONNX_INT8_FILE, "session_options": session_options},
+            )
+        except Exception as e:
+            # onnxruntime/optimum not installed (or an older sentence-transformers)
+            # the plain PyTorch model works the same, just slower
+            print(f"ONNX backend unavailable ({e}), using PyTorch")
+            model = SentenceTransformer(MODEL_NAME)
+    print(f"Model loaded! ({model.device})")
     return model
 
 
-def embed_texts(texts: list[str], batch_size: int = 32, 
+def _default_batch_size(model: SentenceTransformer) -> int:
+    """GPUs have the memory (and parallelism) for bigger batches"""
+    return 64 if model.device.type == "cuda" else 32
+
+
+def embed_texts(texts: list[str], batch_size: Optional[int] = None, 
                 show_progress: bool = False) -> np.ndarray:
     """
     embed a list of texts into vectors
     
     Args:
         texts: List of strings to embed
-        batch_size: How many to process at once (memory management)
+        batch_size: How many to process at once (memory management),
+            defaults to 64 on GPU and 32 on CPU
         show_progress: Show a progress bar (useful for large batches)
     
     Returns:
@@ -39,9 +129,11 @@ def embed_texts(texts: list[str], batch_size: int = 32,
     """
     model = get_model()
     
+    # encode() already does "smart batching" - it sorts texts by length,
+    # batches neighbors (so little padding) and puts results back in order
     embeddings = model.encode(
         texts,
-        batch_size=batch_size,
+        batch_size=batch_size or _default_batch_size(model),
         show_progress_bar=show_progress,
         convert_to_numpy=True,
         normalize_embeddings=True  # Important for cosine similarity!
@@ -50,20 +142,117 @@ def embed_texts(texts: list[str], batch_size: int = 32,
     return embeddings
 
 
-def embed_query(query: str) -> np.ndarray:
+def get_tokenizer():
     """
-    embed a single search query
-    returns a 1D normalized vector
+    the model's own (fast, Rust-backed) tokenizer, for pre-tokenizing chunks
+    None if the model only has a slow python one - then pre-tokenizing isn't
+    worth it and chunks just get embedded from their text
+    """
+    tokenizer = get_model().tokenizer
+    return tokenizer if getattr(tokenizer, "is_fast", False) else None
+
+
+def embed_tokenized(input_ids: list[np.ndarray], batch_size: Optional[int] = None) -> np.ndarray:
+    """
+    embed texts that were already tokenized with get_tokenizer()
+    (see chunking.tokenize) - skips the tokenizer, just pads and runs the model
+    
+    Args:
+        input_ids: One array of token ids per text, special tokens included
+        batch_size: How many to process at once (memory management),
+            defaults to 64 on GPU and 32 on CPU
+    
+    Returns:
+        numpy array of shape (len(input_ids), embedding_dim), L2 normalized
+        same vectors embed_texts would give for the original texts
     """
     model = get_model()
+    batch_size = batch_size or _default_batch_size(model)
+    max_len = model.max_seq_length
+    pad_id = model.tokenizer.pad_token_id
     
-    embedding = model.encode(
-        query,
-        convert_to_numpy=True,
-        normalize_embeddings=True
-    )
+    # smart batching: go through the texts shortest first so every batch holds
+    # similar lengths and barely needs padding, then put them back in order
+    order = np.argsort([len(ids) for ids in input_ids], kind="stable")
+    
+    embeddings = []
+    for start in range(0, len(order), batch_size):
+        batch = []
+        for i in order[start:start + batch_size]:
+            ids = input_ids[i]
+            if len(ids) > max_len:
+                # truncate like the tokenizer would - keep the closing special token
+                ids = np.concatenate([ids[:max_len - 1], ids[-1:]])
+            batch.append(ids)
+        
+        # pad to the longest in this batch, mask out the padding
+        width = max(len(ids) for ids in batch)
+        padded = np.full((len(batch), width), pad_id, dtype=np.int64)
+        mask = np.zeros((len(batch), width), dtype=np.int64)
+        for i, ids in enumerate(batch):
+            padded[i, :len(ids)] = ids
+            mask[i, :len(ids)] = 1
+        
+        features = {
+            "input_ids": torch.from_numpy(padded).to(model.device),
+            "attention_mask": torch.from_numpy(mask).to(model.device),
+            "token_type_ids": torch.zeros((len(batch), width), dtype=torch.long, device=model.device),
+        }
+        with torch.inference_mode():
+            vectors = model(features)["sentence_embedding"]
+        vectors = torch.nn.functional.normalize(vectors, p=2, dim=1)  # cosine similarity
+        embeddings.append(vectors.float().cpu().numpy())
+    
+    embeddings = np.concatenate(embeddings)
+    unsorted = np.empty_like(embeddings)
+    unsorted[order] = embeddings
+    return unsorted
+
+
+def embed_queries(queries: list[str], batch_size: int = 64) -> np.ndarray:
+    """
+    embed several search queries at once
+    cached queries are reused, the rest go through the model in one batch
+    
+    returns an array of shape (len(queries), embedding_dim), L2 normalized.
+    rows are shared with the cache, so they're read-only
+    """
+    if not queries:
+        return np.empty((0, get_embedding_dim()), dtype=np.float32)
     
-    return embedding
+    with _query_cache_lock:
+        cached = {}
+        for q in queries:
+            if q in _query_cache:
+                _query_cache.move_to_end(q)
+                cached[q] = _query_cache[q]
+    
+    misses = [q for q in dict.fromkeys(queries) if q not in cached]
+    if misses:
+        model = get_model()
+        vectors = model.encode(
+            misses,
+            batch_size=batch_size,
+            convert_to_numpy=True,
+            normalize_embeddings=True
+        )
+        
+        with _query_cache_lock:
+            for q, vector in zip(misses, vectors):
+                vector.flags.writeable = False
+                cached[q] = _query_cache[q] = vector
+            while len(_query_cache) > QUERY_CACHE_SIZE:
+                _query_cache.popitem(last=False)
+    
+    return np.stack([cached[q] for q in queries])
+
+
+def embed_query(query: str) -> np.ndarray:
+    """
+    embed a single search query (cached, see embed_queries)
+    returns a 1D normalized vector
+    """
+    return embed_queries([query])[0]
 
 
 def get_embedding_dim() -> int:
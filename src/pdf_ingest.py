@@ -3,53 +3,126 @@ PDF ingestion - reads PDFs page by page
 straightforward stuff, nothing fancy
 """
 
+import multiprocessing
+import os
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from pypdf import PdfReader
+from typing import Iterator
 
+import pypdfium2 as pdfium
 
-def extract_text_by_page(pdf_path: Path) -> list[dict]:
+# worker processes start from a clean forkserver (spawn where that's missing)
+# instead of forking us - we run torch/tokenizer/gradio threads, and forking a
+# multithreaded process can leave the child deadlocked on a lock nobody will release
+MP_CONTEXT = multiprocessing.get_context(
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+)
+
+# PDFium isn't thread-safe, not even across different documents, and
+# two indexing runs can be going at once - only one thread calls into it at a time.
+# held per page rather than per document, so a slow consumer doesn't block everyone
+_pdfium_lock = threading.Lock()
+
+
+def iter_pages(pdf_path: Path) -> Iterator[dict]:
     """
-    extract text from a PDF, keeping track of page numbers
+    yield a PDF's pages one at a time, keeping track of page numbers
     
-    returns list of dicts like:
-    [{"page_num": 1, "text": "..."}, {"page_num": 2, "text": "..."}, ...]
+    yields dicts like {"page_num": 1, "text": "..."} - only one page's text
+    is held at once, the document gets closed once you're done (or stop early)
     
     page numbers start at 1 because that's what makes sense to humans
     """
-    pages = []
-    
     try:
-        reader = PdfReader(pdf_path)
+        # PDFium does the parsing in C++, a lot faster than pure python pypdf
+        with _pdfium_lock:
+            pdf = pdfium.PdfDocument(pdf_path)
+            num_pages = len(pdf)
         
-        for i, page in enumerate(reader.pages):
-            text = page.extract_text() or ""
-            # clean it up a bit
-            text = text.strip()
-            
-            if text:  # only add pages with actual content
-                pages.append({
-                    "page_num": i + 1,  # 1-indexed like normal people expect
-                    "text": text
-                })
+        try:
+            for i in range(num_pages):
+                with _pdfium_lock:
+                    page = pdf[i]
+                    textpage = page.get_textpage()
+                    text = textpage.get_text_range()
+                    textpage.close()
+                    page.close()
+                
+                # clean it up a bit (PDFium uses \r\n for line breaks)
+                text = text.replace("\r\n", "\n").strip()
+                
+                if text:  # only yield pages with actual content
+                    yield {
+                        "page_num": i + 1,  # 1-indexed like normal people expect
+                        "text": text
+                    }
+        finally:
+            with _pdfium_lock:
+                pdf.close()
         
     except Exception as e:
         # stuff breaks sometimes with weird PDFs, just log it and keep going
         print(f"couldn't read {pdf_path.name}: {e}")
+
+
+def extract_text_by_page(pdf_path: Path) -> list[dict]:
+    """
+    extract all the text from a PDF, keeping track of page numbers
+    
+    returns list of dicts like:
+    [{"page_num": 1, "text": "..."}, {"page_num": 2, "text": "..."}, ...]
+    
+    same pages as iter_pages(), just collected - chunking needs the whole
+    document at once anyway to chunk across page boundaries
+    """
+    return list(iter_pages(pdf_path))
+
+
+def iter_extracted(pdf_paths: list[Path]) -> Iterator[tuple[str, list[dict]]]:
+    """
+    extract several PDFs in parallel, one worker process per PDF
+
+    yields (filename, pages) in the original order as each PDF finishes,
+    skipping PDFs with no text. parsing is CPU bound and PDFium isn't
+    safe to share between threads, so each PDF gets its own process
+    """
+    if len(pdf_paths) <= 1:
+        # not worth spinning up worker processes for one file
+        results = map(extract_text_by_page, pdf_paths)
+        for path, pages in zip(pdf_paths, results):
+            if pages:
+                yield path.name, pages
+        return
     
-    return pages
+    workers = min(len(pdf_paths), os.cpu_count() or 1)
+    executor = ProcessPoolExecutor(max_workers=workers, mp_context=MP_CONTEXT)
+    # only keep about one PDF per worker in flight - map() would submit the
+    # whole list at once, and finished page lists would pile up in memory
+    # no matter how slowly the caller takes them
+    in_flight = deque()
+    try:
+        for path in pdf_paths:
+            in_flight.append((path, executor.submit(extract_text_by_page, path)))
+            if len(in_flight) < workers:
+                continue
+            path, future = in_flight.popleft()
+            if pages := future.result():
+                yield path.name, pages
+        while in_flight:
+            path, future = in_flight.popleft()
+            if pages := future.result():
+                yield path.name, pages
+    finally:
+        # if we're closed early, don't keep parsing PDFs nobody will read
+        executor.shutdown(cancel_futures=True)
 
 
 def extract_from_multiple(pdf_paths: list[Path]) -> dict[str, list[dict]]:
     """
-    extract text from multiple PDFs
+    extract text from multiple PDFs (in parallel, see iter_extracted)
     
     returns dict mapping filename -> list of pages
     """
-    results = {}
-    
-    for path in pdf_paths:
-        pages = extract_text_by_page(path)
-        if pages:
-            results[path.name] = pages
-    
-    return results
+    return dict(iter_extracted(pdf_paths))
@@ -0,0 +1,138 @@
+"""
+Indexing pipeline - extraction, chunking and embedding run side by side
+so PDF parsing overlaps with the (slow) embedding step
+"""
+
+import os
+import queue
+import threading
+from collections import deque
+from contextlib import closing
+from pathlib import Path
+from typing import Iterator
+
+from .pdf_ingest import iter_extracted
+from .chunking import chunking_pool, load_cached_chunks, process_all_documents, submit_document
+from .embedder import get_tokenizer
+
+# bounded queues keep only a few documents in flight between stages
+QUEUE_SIZE = 4
+
+# how often (seconds) a blocked stage checks whether the pipeline was stopped
+_POLL_SECONDS = 0.1
+
+# marks the end of a stage's output
+_DONE = object()
+
+
+def _put(out_queue: queue.Queue, item, stop: threading.Event) -> bool:
+    """put an item on a queue, giving up if the pipeline gets stopped while it's full"""
+    while not stop.is_set():
+        try:
+            out_queue.put(item, timeout=_POLL_SECONDS)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _run_stage(work, out_queue: queue.Queue, stop: threading.Event):
+    """run a stage, passing any error downstream and always signalling when it's done"""
+    try:
+        work()
+    except Exception as e:
+        _put(out_queue, e, stop)
+    finally:
+        _put(out_queue, _DONE, stop)
+
+
+def _drain(in_queue: queue.Queue, stop: threading.Event) -> Iterator:
+    """yield items from a stage until it's done (or stopped), re-raising anything it failed with"""
+    while True:
+        try:
+            item = in_queue.get(timeout=_POLL_SECONDS)
+        except queue.Empty:
+            if stop.is_set():
+                return
+            continue
+        if item is _DONE:
+            return
+        if isinstance(item, Exception):
+            raise item
+        yield item
+
+
+def stream_chunks(pdf_paths: list[Path]) -> Iterator[dict]:
+    """
+    yield chunks for all the PDFs as soon as they're ready
+    
+    extraction and chunking each run in their own thread, so whoever consumes
+    this (build_index) can embed while the next PDFs are still being read.
+    PDFs with cached chunks are served straight from the cache.
+    chunks come pre-tokenized, so tokenizing happens here too instead of
+    holding up the embedder.
+    
+    if the consumer stops early or anything fails, the stages get told to
+    stop too - no threads (or worker processes) are left hanging around
+    """
+    tokenizer = get_tokenizer()
+    cached, pending = load_cached_chunks(pdf_paths, tokenizer)
+    yield from cached
+    
+    if not pending:
+        return
+    
+    pages_queue = queue.Queue(maxsize=QUEUE_SIZE)
+    chunks_queue = queue.Queue(maxsize=QUEUE_SIZE)
+    stop = threading.Event()
+    
+    def extract():
+        # PDFs get parsed in parallel worker processes, but still arrive in order
+        with closing(iter_extracted(pending)) as extracted:
+            for filename, pages in extracted:
+                if not _put(pages_queue, (filename, pages), stop):
+                    return
+    
+    workers = min(len(pending), os.cpu_count() or 1)
+    
+    def chunk():
+        if workers <= 1:
+            # not worth spinning up worker processes for one file
+            for filename, pages in _drain(pages_queue, stop):
+                # list() so the chunking work happens here, not in the consumer
+                chunks = list(process_all_documents({filename: pages}, tokenizer))
+                if not _put(chunks_queue, chunks, stop):
+                    return
+            return
+        
+        # one pool for the whole run, documents get chunked side by side
+        # as they arrive and are passed on in their original order
+        pool = chunking_pool(tokenizer, workers)
+        in_flight = deque()
+        try:
+            for filename, pages in _drain(pages_queue, stop):
+                in_flight.append(submit_document(pool, filename, pages))
+                while in_flight and (in_flight[0].done() or len(in_flight) > workers):
+                    if not _put(chunks_queue, in_flight.popleft().result(), stop):
+                        return
+            while in_flight:
+                if not _put(chunks_queue, in_flight.popleft().result(), stop):
+                    return
+        finally:
+            pool.shutdown(cancel_futures=True)
+    
+    threads = [
+        threading.Thread(target=_run_stage, args=(work, out_queue, stop), daemon=True)
+        for work, out_queue in ((extract, pages_queue), (chunk, chunks_queue))
+    ]
+    for thread in threads:
+        thread.start()
+    
+    try:
+        for chunks in _drain(chunks_queue, stop):
+            yield from chunks
+    finally:
+        # covers errors, the consumer closing us early, and the normal finish
+        stop.set()
+        for thread in threads:
+            thread.join()
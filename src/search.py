@@ -2,59 +2,156 @@
 Search functionality - find relevant chunks from queries
 """
 
+import re
+import threading
+
+import faiss
 import numpy as np
+import pyarrow as pa
+from functools import lru_cache
 from typing import Optional
 
-from .embedder import embed_query
-from .storage import load_faiss_index, load_metadata, index_exists
+from .embedder import embed_queries
+from .storage import FAISS_INDEX_PATH, METADATA_PATH, load_faiss_index_gpu, load_metadata_table, index_exists
+
+# how many IVF clusters to scan per query (only used for huge, IVF-based indexes)
+# higher = better recall, slower search
+DEFAULT_NPROBE = 16
+
+# how many graph candidates to keep per query (only used for HNSW indexes)
+# same tradeoff - higher = better recall, slower search
+DEFAULT_EF_SEARCH = 64
+
+
+# FAISS output buffers, reused between searches of the same shape instead of
+# allocating fresh ones per query. per thread, since Gradio runs callbacks in parallel
+_result_buffers = threading.local()
+
 
+def _result_buffers_for(num_queries: int, k: int) -> tuple[np.ndarray, np.ndarray]:
+    """(scores, indices) arrays of shape (num_queries, k) for this thread to search into"""
+    buffers = getattr(_result_buffers, "by_shape", None)
+    if buffers is None:
+        buffers = _result_buffers.by_shape = {}
+    
+    shape = (num_queries, k)
+    if shape not in buffers:
+        if len(buffers) >= 8:
+            buffers.clear()  # only a handful of (batch, k) shapes ever show up
+        buffers[shape] = (np.empty(shape, dtype=np.float32), np.empty(shape, dtype=np.int64))
+    return buffers[shape]
+
+
+def _apply_search_params(index: faiss.Index, k: int, nprobe: int, ef_search: int):
+    """set the recall/latency knobs for whichever index type we loaded"""
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.nprobe = nprobe
+    elif hasattr(index, "nprobe"):
+        index.nprobe = nprobe  # GPU IVF indexes
+    if hasattr(index, "hnsw"):
+        # never keep fewer candidates than results we want back
+        index.hnsw.efSearch = max(ef_search, k)
 
-def search(query: str, k: int = 5) -> Optional[list[dict]]:
+
+def search_batch(queries: list[str], k: int = 5, nprobe: int = DEFAULT_NPROBE, 
+                 ef_search: int = DEFAULT_EF_SEARCH) -> Optional[list[list[dict]]]:
     """
-    search the index for chunks most similar to the query
+    search the index for chunks most similar to each query
+    all queries get embedded in one batch and looked up with one FAISS
+    call (which spreads them across cores)
     
     Args:
-        query: The search query text
-        k: Number of results to return
+        queries: The search query texts
+        k: Number of results to return per query
+        nprobe: Clusters to scan if the index is IVF (recall vs latency)
+        ef_search: Graph candidates to keep if the index is HNSW (recall vs latency)
     
     Returns:
-        List of result dicts with metadata + similarity scores,
+        One list of result dicts (metadata + similarity score) per query,
         or None if index doesn't exist
     """
     if not index_exists():
         return None
     
-    index = load_faiss_index()
-    metadata = load_metadata()
+    index = load_faiss_index_gpu()
+    metadata = load_metadata_table()
     
     if index is None or metadata is None:
         return None
     
-    # embed the query
-    query_vector = embed_query(query)
+    # embed the queries - the model is uncased, so lowercasing doesn't change
+    # the vectors but does make repeats hit the query cache
+    query_vectors = embed_queries([q.strip().lower() for q in queries])
+    # FAISS wants contiguous float32 - that's what we usually get already, so no copy
+    query_vectors = np.ascontiguousarray(query_vectors, dtype=np.float32)
     
-    # reshape for FAISS (needs 2D array)
-    query_vector = query_vector.reshape(1, -1).astype(np.float32)
+    _apply_search_params(index, k, nprobe, ef_search)
     
-    # search! returns distances and indices
+    # search! returns distances and indices, one row per query
     # since we use inner product with normalized vectors, higher = more similar
-    scores, indices = index.search(query_vector, min(k, index.ntotal))
-    
-    # flatten results (they come as 2D arrays)
-    scores = scores[0]
-    indices = indices[0]
+    # (the buffers get reused, so everything below copies out of them before returning)
+    top_k = min(k, index.ntotal)
+    all_scores, all_indices = _result_buffers_for(len(query_vectors), top_k)
+    index.search(query_vectors, top_k, D=all_scores, I=all_indices)
     
-    # build result list
-    results = []
-    for score, idx in zip(scores, indices):
-        if idx == -1:  # FAISS returns -1 for empty slots
-            continue
+    all_results = []
+    for scores, indices in zip(all_scores, all_indices):
+        # FAISS returns -1 for empty slots
+        found = indices != -1
+        scores = scores[found]
+        indices = indices[found]
         
-        chunk_meta = metadata[idx].copy()
-        chunk_meta["similarity_score"] = float(score)
-        results.append(chunk_meta)
+        # only the hits get turned into dicts, the rest of the metadata stays mapped
+        results = metadata.take(pa.array(indices)).to_pylist()
+        for chunk_meta, score in zip(results, scores):
+            chunk_meta["similarity_score"] = float(score)
+        all_results.append(results)
     
-    return results
+    return all_results
+
+
+def search_one(query: str, k: int = 5, nprobe: int = DEFAULT_NPROBE, 
+               ef_search: int = DEFAULT_EF_SEARCH) -> Optional[list[dict]]:
+    """
+    search the index for chunks most similar to the query
+    
+    Args:
+        query: The search query text
+        k: Number of results to return
+        nprobe: Clusters to scan if the index is IVF (recall vs latency)
+        ef_search: Graph candidates to keep if the index is HNSW (recall vs latency)
+    
+    Returns:
+        List of result dicts with metadata + similarity scores,
+        or None if index doesn't exist
+    """
+    try:
+        # part of the cache key, so results from an older index are never reused
+        index_version = (FAISS_INDEX_PATH.stat().st_mtime_ns, METADATA_PATH.stat().st_mtime_ns)
+    except FileNotFoundError:
+        return None
+    
+    results = _cached_search(query.strip().lower(), k, nprobe, ef_search, index_version)
+    if results is None:
+        return None
+    # fresh dicts every time, so callers can't mess up the cached copy
+    return [dict(r) for r in results]
+
+
+@lru_cache(maxsize=1024)
+def _cached_search(query_norm: str, k: int, nprobe: int, ef_search: int,
+                   index_version: tuple[int, int]) -> Optional[tuple]:
+    """
+    whole search results for a normalized query - popular/repeated queries
+    skip the embedding *and* the FAISS lookup. results are stored as tuples
+    so they can't be changed. index_version (the index + metadata mtimes) is
+    just part of the key - a rebuild changes it, and old entries age out
+    """
+    results = search_batch([query_norm], k, nprobe, ef_search)
+    if results is None:
+        return None
+    return tuple(tuple(r.items()) for r in results[0])
 
 
 def format_citation(result: dict, include_pages: bool = True) -> str:
@@ -73,28 +170,41 @@ def format_citation(result: dict, include_pages: bool = True) -> str:
     return f"({filename})"
 
 
+@lru_cache(maxsize=64)
+def _query_pattern(query: str) -> Optional[re.Pattern]:
+    """
+    one compiled regex matching any meaningful query word (skip tiny ones)
+    built once per query, so every result reuses it and the matching
+    happens inside the regex engine instead of a python loop
+    """
+    terms = {w.lower().strip(".,!?;:\"'()[]") for w in query.split()}
+    terms = [t for t in terms if len(t) > 2]
+    if not terms:
+        return None
+    
+    # longest first so a term never loses out to a shorter prefix of itself
+    terms.sort(key=len, reverse=True)
+    alternation = "|".join(re.escape(t) for t in terms)
+    # one capturing group, so pattern.split() hands back the matched words too.
+    # lookarounds instead of \b, so terms like "c++" that end in a symbol still match
+    return re.compile(rf"(?<!\w)({alternation})(?!\w)", re.IGNORECASE)
+
+
 def highlight_keywords(text: str, query: str, 
                        highlight_start: str = "**", 
                        highlight_end: str = "**") -> str:
     """
     simple keyword highlighting - wraps query words found in text
-    case-insensitive matching
+    case-insensitive matching, original casing and spacing are kept
     """
-    # get meaningful words from query (skip tiny ones)
-    query_words = [w.lower() for w in query.split() if len(w) > 2]
+    pattern = _query_pattern(query)
     
-    if not query_words:
+    if pattern is None:
         return text
     
-    # do this word by word to preserve original casing
-    result_words = []
-    for word in text.split():
-        word_lower = word.lower().strip(".,!?;:\"'()[]")
-        
-        if word_lower in query_words:
-            # wrap the word in highlights
-            result_words.append(f"{highlight_start}{word}{highlight_end}")
-        else:
-            result_words.append(word)
-    
-    return " ".join(result_words)
+    # split gives [text, match, text, match, ..., text] in one pass of the regex
+    # engine - wrapping the matches and joining beats calling back into python
+    # for every match with sub(), more so the longer the passage
+    parts = pattern.split(text)
+    parts[1::2] = [f"{highlight_start}{word}{highlight_end}" for word in parts[1::2]]
+    return "".join(parts)
@@ -4,11 +4,12 @@ keeps path logic in one place so it's not scattered everywhere
 """
 
 import os
-import json
+from functools import lru_cache
 from pathlib import Path
 from typing import Optional
 import faiss
 import numpy as np
+import pyarrow as pa
 
 # Base paths - relative to project root
 PROJECT_ROOT = Path(__file__).parent.parent
@@ -17,13 +18,15 @@ UPLOADS_DIR = DATA_DIR / "uploads"
 INDEX_DIR = PROJECT_ROOT / "index"
 
 FAISS_INDEX_PATH = INDEX_DIR / "faiss.index"
-METADATA_PATH = INDEX_DIR / "metadata.json"
+METADATA_PATH = INDEX_DIR / "metadata.arrow"
+CHUNK_CACHE_DIR = INDEX_DIR / "chunk_cache"
 
 
 def ensure_dirs():
     """create our directories if they don't exist. no big deal"""
     UPLOADS_DIR.mkdir(parents=True, exist_ok=True)
     INDEX_DIR.mkdir(parents=True, exist_ok=True)
+    CHUNK_CACHE_DIR.mkdir(parents=True, exist_ok=True)
 
 
 def save_uploaded_file(uploaded_file) -> Path:
@@ -35,6 +38,7 @@ def save_uploaded_file(uploaded_file) -> Path:
     dest = UPLOADS_DIR / Path(uploaded_file.name).name
     with open(dest, "wb") as f:
         f.write(uploaded_file.read())
+    _uploads_changed()
     return dest
 
 
@@ -47,13 +51,41 @@ def save_uploaded_path(file_path: str | Path) -> Path:
     src = Path(file_path)
     dest = UPLOADS_DIR / src.name
     dest.write_bytes(src.read_bytes())
+    _uploads_changed()
     return dest
 
 
+# bumped whenever we change the uploads folder ourselves - overwriting an
+# existing file doesn't change the folder's mtime, but should still refresh listings
+_uploads_version = 0
+
+
+def _uploads_changed():
+    global _uploads_version
+    _uploads_version += 1
+
+
+@lru_cache(maxsize=1)
+def _scan_uploads(mtime_ns: int, version: int) -> tuple[os.DirEntry, ...]:
+    """read the uploads folder once per version of it (both args are just the cache key)"""
+    with os.scandir(UPLOADS_DIR) as entries:
+        pdfs = [e for e in entries if e.name.endswith(".pdf") and e.is_file()]
+    return tuple(sorted(pdfs, key=lambda e: e.name))
+
+
+def scan_uploaded_pdfs() -> list[os.DirEntry]:
+    """
+    get directory entries for all PDFs in the uploads folder, sorted by name
+    one directory read, and entries cache their stat() - handy for listing sizes.
+    the listing is cached until the folder changes, so UI reruns only cost a stat()
+    """
+    ensure_dirs()
+    return list(_scan_uploads(UPLOADS_DIR.stat().st_mtime_ns, _uploads_version))
+
+
 def list_uploaded_pdfs() -> list[Path]:
     """get all PDFs that are sitting in the uploads folder"""
-    ensure_dirs()
-    return sorted(UPLOADS_DIR.glob("*.pdf"))
+    return [Path(e.path) for e in scan_uploaded_pdfs()]
 
 
 def delete_uploaded_file(filename: str) -> bool:
@@ -61,49 +93,172 @@ def delete_uploaded_file(filename: str) -> bool:
     filepath = UPLOADS_DIR / filename
     if filepath.exists():
         filepath.unlink()
+        _uploads_changed()
         return True
     return False
 
 
+# every chunk repeats its file's name and id, so store each distinct value once
+_DICTIONARY_COLUMNS = ("file_name", "doc_id")
+# page numbers easily fit in 32 bits
+_INT32_COLUMNS = ("page_start", "page_end")
+
+
+def _compact_metadata(table: pa.Table) -> pa.Table:
+    """shrink the metadata columns before writing - less to map and scan later"""
+    for i, field in enumerate(table.schema):
+        column = table.column(i)
+        if field.name in _DICTIONARY_COLUMNS and pa.types.is_string(field.type):
+            column = column.dictionary_encode()
+        elif field.name in _INT32_COLUMNS and pa.types.is_integer(field.type):
+            column = column.cast(pa.int32())
+        else:
+            continue
+        table = table.set_column(i, field.name, column)
+    return table
+
+
 def save_metadata(metadata: list[dict]):
-    """dump chunk metadata to JSON"""
+    """
+    write chunk metadata as an Arrow IPC file
+    columnar + memory-mappable, so loading it later doesn't parse anything
+    """
     ensure_dirs()
-    with open(METADATA_PATH, "w", encoding="utf-8") as f:
-        json.dump(metadata, f, indent=2, ensure_ascii=False)
+    table = _compact_metadata(pa.Table.from_pylist(metadata))
+    # write next to it and swap in, so anyone still mapping the old file keeps working
+    tmp_path = METADATA_PATH.with_suffix(".tmp")
+    with pa.OSFile(str(tmp_path), "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(tmp_path, METADATA_PATH)
 
 
-def load_metadata() -> Optional[list[dict]]:
-    """load chunk metadata from JSON. returns None if it doesn't exist"""
+@lru_cache(maxsize=1)
+def _read_metadata_table(path: str, mtime_ns: int) -> pa.Table:
+    """map the file once per version of it on disk (mtime is part of the cache key)"""
+    return pa.ipc.open_file(pa.memory_map(path, "r")).read_all()
+
+
+def load_metadata_table() -> Optional[pa.Table]:
+    """
+    memory-map chunk metadata as an Arrow table. returns None if it doesn't exist
+    zero-copy - rows only become Python objects when you ask for them.
+    the table is cached until the file changes, and it's immutable, so sharing is safe
+    """
     if not METADATA_PATH.exists():
         return None
-    with open(METADATA_PATH, "r", encoding="utf-8") as f:
-        return json.load(f)
+    return _read_metadata_table(str(METADATA_PATH), METADATA_PATH.stat().st_mtime_ns)
+
+
+def load_metadata() -> Optional[list[dict]]:
+    """load all chunk metadata as dicts. returns None if it doesn't exist"""
+    table = load_metadata_table()
+    if table is None:
+        return None
+    return table.to_pylist()
 
 
 def save_faiss_index(index: faiss.Index):
     """write the FAISS index to disk"""
     ensure_dirs()
-    faiss.write_index(index, str(FAISS_INDEX_PATH))
+    # same swap trick as save_metadata - the old file may still be mmapped
+    tmp_path = FAISS_INDEX_PATH.with_suffix(".tmp")
+    faiss.write_index(index, str(tmp_path))
+    os.replace(tmp_path, FAISS_INDEX_PATH)
+
 
+# ways to memory-map the index, tried in order:
+# IO_FLAG_MMAP_IFC maps the flat code arrays (the SQ8 and HNSW tiers), but can't
+# be combined with the IVF tier's lists - those get mapped by IO_FLAG_MMAP alone
+_MMAP_FLAGS = (
+    getattr(faiss, "IO_FLAG_MMAP_IFC", 0) | faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY,
+    faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY,
+)
 
-def load_faiss_index() -> Optional[faiss.Index]:
-    """read the FAISS index from disk. returns None if it doesn't exist"""
+
+def load_faiss_index(writable: bool = False) -> Optional[faiss.Index]:
+    """
+    read the FAISS index from disk. returns None if it doesn't exist
+    
+    memory-mapped read-only by default, so the OS page cache serves the
+    vector codes (shared between processes) instead of us copying the whole
+    file into RAM - flat codes are viewed straight from the file, IVF inverted
+    lists come back as OnDiskInvertedLists over it. never add() to this one:
+    pass writable=True to get a private in-RAM copy you can add vectors to
+    """
     if not FAISS_INDEX_PATH.exists():
         return None
+    if writable:
+        return faiss.read_index(str(FAISS_INDEX_PATH))
+    for flags in _MMAP_FLAGS:
+        try:
+            return faiss.read_index(str(FAISS_INDEX_PATH), flags)
+        except RuntimeError:
+            continue
+    # some FAISS builds/index types can't mmap, a normal read works everywhere
     return faiss.read_index(str(FAISS_INDEX_PATH))
 
 
+# GPU resources hold scratch memory, so allocate them once and reuse them
+_gpu_resources = None
+
+
+@lru_cache(maxsize=1)
+def _read_search_index(path: str, mtime_ns: int) -> faiss.Index:
+    """
+    open the index for searching once per version of it on disk (mtime is
+    part of the cache key) - parsing the file and copying to the GPU
+    aren't free, so a query shouldn't pay for them
+    """
+    global _gpu_resources
+    
+    index = load_faiss_index()
+    num_gpus = faiss.get_num_gpus() if hasattr(faiss, "get_num_gpus") else 0
+    if num_gpus == 0 or faiss.try_extract_index_ivf(index) is None:
+        # only the IVF tier has a GPU version, the rest stay mmapped on CPU
+        return index
+    
+    try:
+        # copy from a plain in-RAM read, the GPU can't use the mapped lists anyway
+        cpu_index = faiss.read_index(path)
+        if num_gpus > 1:
+            return faiss.index_cpu_to_all_gpus(cpu_index)
+        if _gpu_resources is None:
+            _gpu_resources = faiss.StandardGpuResources()
+        return faiss.index_cpu_to_gpu(_gpu_resources, 0, cpu_index)
+    except RuntimeError as e:
+        print(f"index can't go on the GPU ({e}), searching on CPU")
+        return index
+
+
+def load_faiss_index_gpu() -> Optional[faiss.Index]:
+    """
+    load the FAISS index for searching, on the GPU(s) if this FAISS build has any
+    
+    only the IVF tier gets copied to the GPU - everything else (faiss-cpu,
+    the SQ8 flat and HNSW tiers, a failed copy) is the normal mmapped CPU index.
+    cached until the file changes - treat it as read-only.
+    returns None if there's no index on disk
+    """
+    if not FAISS_INDEX_PATH.exists():
+        return None
+    return _read_search_index(str(FAISS_INDEX_PATH), FAISS_INDEX_PATH.stat().st_mtime_ns)
+
+
 def index_exists() -> bool:
     """check if we have a built index ready to search"""
     return FAISS_INDEX_PATH.exists() and METADATA_PATH.exists()
 
 
 def clear_index():
-    """nuke the index files (uploads stay safe though)"""
+    """nuke the index files and cached chunks (uploads stay safe though)"""
     if FAISS_INDEX_PATH.exists():
         FAISS_INDEX_PATH.unlink()
     if METADATA_PATH.exists():
         METADATA_PATH.unlink()
+    if CHUNK_CACHE_DIR.exists():
+        for cache_path in CHUNK_CACHE_DIR.glob("*.pkl"):
+            cache_path.unlink(missing_ok=True)
 
 
 def get_index_stats() -> Optional[dict]:
@@ -111,11 +266,11 @@ def get_index_stats() -> Optional[dict]:
     if not index_exists():
         return None
     
-    metadata = load_metadata()
-    index = load_faiss_index()
+    metadata = load_metadata_table()
+    index = load_faiss_index_gpu()  # the cached one search uses
     
     # Count unique docs
-    unique_docs = set(m["file_name"] for m in metadata)
+    unique_docs = metadata.column("file_name").unique().to_pylist()
     
     # Get file size
     index_size_bytes = FAISS_INDEX_PATH.stat().st_size
@@ -127,9 +282,9 @@ def get_index_stats() -> Optional[dict]:
         size_str = f"{index_size_bytes / (1024*1024):.2f} MB"
     
     return {
-        "total_chunks": len(metadata),
+        "total_chunks": metadata.num_rows,
         "total_docs": len(unique_docs),
-        "doc_names": list(unique_docs),
+        "doc_names": unique_docs,
         "embedding_dim": index.d,
         "index_size": size_str,
     }
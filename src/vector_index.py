@@ -5,54 +5,154 @@ building, saving, and loading the search index
 
 import faiss
 import numpy as np
-from typing import Optional
+from itertools import islice
+from typing import Iterable, Iterator, Optional, Sized
 
-from .embedder import embed_texts, get_embedding_dim
+from .embedder import embed_texts, embed_tokenized, get_embedding_dim, thread_count_from_env
 from .storage import save_faiss_index, save_metadata, load_faiss_index, load_metadata
 
+# FAISS threads - every core by default, FAISS_NUM_THREADS (or OMP_NUM_THREADS) to override
+# some faiss builds otherwise add/search on a single thread
+FAISS_NUM_THREADS = thread_count_from_env("FAISS_NUM_THREADS", "OMP_NUM_THREADS")
+faiss.omp_set_num_threads(FAISS_NUM_THREADS)
 
-def build_index(chunks: list[dict], progress_callback=None) -> tuple[faiss.Index, list[dict]]:
+# how many chunks get handed to the embedder at once
+# big enough to keep the model busy, small enough that a stream never piles up
+EMBED_BATCH_CHUNKS = 512
+
+# past this many chunks, brute-force scanning every vector gets slow,
+# so we switch to an HNSW graph that only visits a few hundred of them
+HNSW_MIN_CHUNKS = 10_000
+# HNSW neighbor candidates while building - higher = better graph, slower build
+HNSW_EF_CONSTRUCTION = 200
+
+# past this many, the graph links cost too much memory and build time,
+# so we switch to an inverted-file index that only scans a few clusters
+IVF_MIN_CHUNKS = 1_000_000
+
+# below this many vectors, add_to_index just rebuilds - it's cheap, and the
+# 8-bit ranges learned from a handful of vectors don't fit new ones well
+INCREMENTAL_MIN_CHUNKS = 1_000
+
+
+def _batched(items: Iterable[dict], size: int) -> Iterator[list[dict]]:
+    """group an iterable into lists of up to `size` items"""
+    it = iter(items)
+    while batch := list(islice(it, size)):
+        yield batch
+
+
+def _index_tier(num_vectors: int) -> str:
+    """which kind of index fits this many vectors - "flat", "hnsw" or "ivf" """
+    if num_vectors > IVF_MIN_CHUNKS:
+        return "ivf"
+    if num_vectors >= HNSW_MIN_CHUNKS:
+        return "hnsw"
+    return "flat"
+
+
+def _create_index(embeddings: np.ndarray) -> faiss.Index:
     """
-    build a FAISS index from chunk metadata
+    make a trained, filled FAISS index for these embeddings
     
-    Args:
-        chunks: List of chunk dicts (must have 'text' field)
-        progress_callback: Optional callback(current, total) for progress updates
+    inner product because our vectors are normalized, and inner product of
+    normalized vectors = cosine similarity. which index depends on size:
     
-    Returns:
-        (faiss_index, metadata_list)
+    small: every vector gets scanned, stored as 8-bit codes (SQ8) instead of
+        float32 - 4x smaller and 4x less memory traffic per query.
+    medium: same 8-bit codes, but linked into an HNSW graph so a query only
+        walks a few hundred of them - roughly logarithmic search.
+    huge: vectors are rotated (OPQ, so they compress better), clustered (IVF)
+        and product-quantized to 32 bytes - 48x smaller than float32, and a
+        query only scans the `nprobe` closest clusters.
+    
+    either way the index has to see the embeddings (train) before we add them
     """
-    if not chunks:
-        raise ValueError("No chunks to index!")
+    num_vectors, dim = embeddings.shape
     
-    texts = [c["text"] for c in chunks]
-    total = len(texts)
+    tier = _index_tier(num_vectors)
+    if tier == "ivf":
+        # ~4*sqrt(N) clusters, but keep ~39 training points per cluster
+        nlist = min(4 * int(np.sqrt(num_vectors)), num_vectors // 39)
+        description = f"OPQ32,IVF{nlist},PQ32"
+    elif tier == "hnsw":
+        description = "HNSW32,SQ8"
+    else:
+        description = "SQ8"
+    
+    index = faiss.index_factory(dim, description, faiss.METRIC_INNER_PRODUCT)
+    if hasattr(index, "hnsw"):
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+    index.train(embeddings)
+    index.add(embeddings)
+    return index
+
+
+def _embed_chunks(chunks: Iterable[dict], progress_callback=None) -> tuple[np.ndarray, list[dict]]:
+    """
+    embed chunks batch by batch as they arrive (works on lists and streams)
+    returns (float32 embeddings, metadata), same order as the chunks
+    """
+    total = len(chunks) if isinstance(chunks, Sized) else None
     
     if progress_callback:
         progress_callback(0, total)
     
-    # embed all the chunks - this is the slow part
-    print(f"Embedding {total} chunks...")
-    embeddings = embed_texts(texts, show_progress=True)
+    metadata = []
+    batch_embeddings = []
     
-    if progress_callback:
-        progress_callback(total // 2, total)
+    # embed the chunks - this is the slow part
+    print("Embedding chunks...")
+    for batch in _batched(chunks, EMBED_BATCH_CHUNKS):
+        # both embed functions sort by length internally ("smart batching")
+        if all("input_ids" in c for c in batch):
+            # pre-tokenized (see chunking.tokenize), no need to tokenize again
+            embeddings = embed_tokenized([c["input_ids"] for c in batch])
+        else:
+            embeddings = embed_texts([c["text"] for c in batch])
+        # held as fp16 until the index is built - half the memory for a big
+        # stream, and way more precision than the 8-bit index codes keep anyway
+        batch_embeddings.append(embeddings.astype(np.float16))
+        
+        # token ids are only for embedding, they don't belong in saved metadata
+        metadata.extend({k: v for k, v in c.items() if k != "input_ids"} for c in batch)
+        
+        if progress_callback:
+            progress_callback(len(metadata), total)
+    
+    if not metadata:
+        return np.empty((0, get_embedding_dim()), dtype=np.float32), metadata
+    
+    # straight into one float32 array, FAISS only takes float32
+    return np.concatenate(batch_embeddings, dtype=np.float32), metadata
+
+
+def build_index(chunks: Iterable[dict], progress_callback=None) -> tuple[faiss.Index, list[dict]]:
+    """
+    build a FAISS index from chunk metadata
     
-    # build FAISS index
-    # using IndexFlatIP (inner product) because our vectors are normalized
-    # inner product of normalized vectors = cosine similarity
-    dim = embeddings.shape[1]
-    index = faiss.IndexFlatIP(dim)
+    chunks can be a list or a stream (e.g. a generator that's still being fed
+    by extraction + chunking) - they get embedded batch by batch as they arrive
     
-    # add vectors to index
-    index.add(embeddings.astype(np.float32))
+    Args:
+        chunks: Chunk dicts (must have 'text' field)
+        progress_callback: Optional callback(current, total) for progress updates,
+            total is None when chunks is a stream of unknown length
     
-    if progress_callback:
-        progress_callback(total, total)
+    Returns:
+        (faiss_index, metadata_list)
+    """
+    embeddings, metadata = _embed_chunks(chunks, progress_callback)
+    
+    if not metadata:
+        raise ValueError("No chunks to index!")
+    
+    # build FAISS index once everything is embedded, so it can train on all of it
+    index = _create_index(embeddings)
     
-    print(f"Index built: {index.ntotal} vectors, dim={dim}")
+    print(f"Index built: {index.ntotal} vectors, dim={index.d}")
     
-    return index, chunks
+    return index, metadata
 
 
 def save_index_and_metadata(index: faiss.Index, metadata: list[dict]):
@@ -64,10 +164,10 @@ def save_index_and_metadata(index: faiss.Index, metadata: list[dict]):
 
 def load_index_and_metadata() -> Optional[tuple[faiss.Index, list[dict]]]:
     """
-    load the index and metadata from disk
+    load the index and metadata from disk, ready for add_to_index
     returns None if either doesn't exist
     """
-    index = load_faiss_index()
+    index = load_faiss_index(writable=True)
     metadata = load_metadata()
     
     if index is None or metadata is None:
@@ -76,15 +176,53 @@ def load_index_and_metadata() -> Optional[tuple[faiss.Index, list[dict]]]:
     return index, metadata
 
 
+def _fits_trained_range(index: faiss.Index, embeddings: np.ndarray) -> bool:
+    """
+    can these vectors go into the index without losing precision?
+    SQ8 codes only cover the per-dimension min/max seen while training,
+    anything outside gets clipped. PQ codes (the IVF tier) have no such limit
+    """
+    index = faiss.downcast_index(index)
+    if hasattr(index, "storage"):
+        index = faiss.downcast_index(index.storage)  # HNSW keeps its codes here
+    if not isinstance(index, faiss.IndexScalarQuantizer):
+        return True
+    
+    trained = faiss.vector_to_array(index.sq.trained)
+    vmin, vdiff = trained[:index.d], trained[index.d:2 * index.d]
+    # half a quantization step of slack - that still lands in the edge bucket,
+    # and it absorbs float rounding in min + diff
+    slack = vdiff / 510
+    return bool(np.all(embeddings >= vmin - slack) and np.all(embeddings <= vmin + vdiff + slack))
+
+
 def add_to_index(index: faiss.Index, new_chunks: list[dict], 
                  existing_metadata: list[dict]) -> tuple[faiss.Index, list[dict]]:
     """
     add new chunks to an existing index
     returns the updated index and metadata
     
-    Note: For simplicity, we rebuild from scratch. FAISS IndexFlatIP supports
-    incremental adds, but managing metadata alignment gets messy.
-    For a small-medium knowledge base, rebuild is fast enough.
+    only the new chunks get embedded - the index is already trained, so they
+    go straight in with index.add and line up with metadata appended at the end.
+    it gets rebuilt from scratch instead when the index is still small, when
+    the new total crosses into a different index type (see _create_index),
+    or when the new vectors fall outside what the 8-bit codes were trained on
     """
-    all_chunks = existing_metadata + new_chunks
-    return build_index(all_chunks)
+    total = index.ntotal + len(new_chunks)
+    if index.ntotal < INCREMENTAL_MIN_CHUNKS or _index_tier(index.ntotal) != _index_tier(total):
+        return build_index(existing_metadata + new_chunks)
+    
+    embeddings, new_metadata = _embed_chunks(new_chunks)
+    
+    if not _fits_trained_range(index, embeddings):
+        # retrain on everything - only the old chunks still need embedding
+        old_embeddings, _ = _embed_chunks(existing_metadata)
+        index = _create_index(np.concatenate([old_embeddings, embeddings]))
+        print(f"Index rebuilt: {index.ntotal} vectors, dim={index.d}")
+        return index, existing_metadata + new_metadata
+    
+    index.add(embeddings)
+    
+    print(f"Index updated: {index.ntotal} vectors, dim={index.d}")
+    
+    return index, existing_metadata + new_metadata